@@ -6,14 +6,48 @@ Made by Xander de Haan
 import ffmpeg
 
 import os
-import time
-import threading
-import tempfile
+import subprocess
+import sys
+import asyncio
+import collections
+import contextlib
+import functools
 
 # Directory View Options
 MAX_FILENAME_LEN = 20
 PROGRESS_BAR_LEN = 40
 VISIBLE_EXTENSIONS = {'mp4'}
+VISIBLE_SUFFIXES = tuple('.' + extension for extension in VISIBLE_EXTENSIONS)
+
+# Encoder Options
+CUDA_DEVICE_MAX_CONNECTIONS = '2'
+NVENC_SESSION_LIMIT = 3 # Drivers allow 3 to 8 NVENC sessions at once depending on the version, every ffmpeg output opens one
+SHORT_VIDEO_DURATION = 30 # Videos shorter than this (in seconds) share an ffmpeg process, up to NVENC_SESSION_LIMIT per process
+ENCODER_OPTIONS = {
+	'c:v': 'hevc_nvenc',
+	'tune': 'hq',
+	'rc': 'cbr',
+	'spatial_aq': '0',
+	'temporal_aq': '0',
+	'rc-lookahead': '0'
+}
+B_FRAME_OPTIONS = {'b_ref_mode': 'middle', 'bf': '2', 'refs': '1'} # Not supported by HEVC NVENC before Turing
+DEFAULT_NVENC_PRESET = 'p4'
+BITRATE_PRESETS = { # Name: (target bitrate in kbps, NVENC preset)
+	'low': (2000, 'p7'),
+	'medium': (5000, 'p4'),
+	'high': (10000, 'p1')
+}
+NVDEC_8_BIT = {'yuv420p', 'yuvj420p', 'nv12'}
+NVDEC_10_BIT = NVDEC_8_BIT | {'yuv420p10le', 'p010le'}
+NVDEC_DECODERS = { # Codec: (decoder, supported pixel formats, minimum compute capability)
+	'h264': ('h264_cuvid', NVDEC_8_BIT, (0, 0)),
+	'mpeg2video': ('mpeg2_cuvid', NVDEC_8_BIT, (0, 0)),
+	'hevc': ('hevc_cuvid', NVDEC_10_BIT, (6, 0)),
+	'vp8': ('vp8_cuvid', NVDEC_8_BIT, (6, 0)),
+	'vp9': ('vp9_cuvid', NVDEC_10_BIT, (6, 0)),
+	'av1': ('av1_cuvid', NVDEC_10_BIT, (8, 0))
+}
 
 # Exit Codes
 OK = 0
@@ -40,8 +74,14 @@ class dir_item:
 	size: int
 	duration: int
 	bitrate: int
+	probe: dict
 	is_selected: bool = False
 
+def get_file_stamp(path):
+	"""Returns (mtime, size) of a file, which changes whenever the file does"""
+	stat = os.stat(path)
+	return stat.st_mtime_ns, stat.st_size
+
 def clean_argument(arg):
 	if isinstance(arg, list):
 		str_arg = ''
@@ -53,126 +93,423 @@ def clean_argument(arg):
 	return arg
 
 def filter_relevant_content(path):
-	"""Filters away irrelevant files"""
-	folder_contents = os.listdir(path)
+	"""Filters away irrelevant files, returns (name, is_file) for everything that's left"""
 	relevant_content = []
-	for item in folder_contents:
-		item_path = os.path.join(path, item)
-		if os.path.isdir(item_path):
-			relevant_content.append(item)
-		elif os.path.isfile(item_path):
-			if item.split('.')[-1].lower() in VISIBLE_EXTENSIONS:
-				relevant_content.append(item)
-		else:
-			print("What... how??")
+	with os.scandir(path) as folder_contents:
+		for entry in folder_contents:
+			if entry.is_dir():
+				relevant_content.append((entry.name, False))
+			elif entry.is_file():
+				if entry.name.lower().endswith(VISIBLE_SUFFIXES):
+					relevant_content.append((entry.name, True))
+			else:
+				print("What... how??")
 	return relevant_content
 
-def monitor_compression_progress(temp_file, text_base, total_frames):
-	last_frame = 0
-	while True:
-		# Read current progress status
-		if os.path.isfile(temp_file):
-			with open(temp_file, 'r') as f:
-				lines = f.readlines()
-				for line in lines:
-					if line.startswith('frame='):
-						last_frame = int(line.split('=')[1])
-					elif line.startswith('progress=end'):
-						print(f'\r{text_base} {" ":<{PROGRESS_BAR_LEN}}  ', end='')
-						print(f'\r{text_base} ✓')
-						return
-		
-		# Update progress bar
-		progress_bar = '#' * round(PROGRESS_BAR_LEN * last_frame / total_frames)
-		print(f'\r{text_base} {progress_bar:<{PROGRESS_BAR_LEN}} |', end='', flush=True)
-
-		# Wait
-		time.sleep(0.5)
-
-def compress_videos(videos: list[dir_item], target_bitrate: int, output_path: str):
-
-	# Set up temp file for progress monitoring
-	temp_file = os.path.join(tempfile.gettempdir(), 'ffmpeg_progress.log')
-
-	# In case something prevented the file from being deleted during previous run
-	if os.path.exists(temp_file):
-		os.remove(temp_file)
+@functools.cache
+def get_compute_capability():
+	"""Asks nvidia-smi for the GPU's compute capability, (0, 0) if it's unknown"""
+	try:
+		result = subprocess.run(
+			['nvidia-smi', '--query-gpu=compute_cap', '--format=csv,noheader'],
+			capture_output=True, text=True, check=True
+		)
+		major, minor = result.stdout.splitlines()[0].strip().split('.')
+		return int(major), int(minor)
+	except (OSError, subprocess.CalledProcessError, IndexError, ValueError):
+		return 0, 0
+
+def gpu_supports_b_frames():
+	"""Checks if the GPU is a Turing (compute capability 7.5) or newer, which HEVC B-frames need"""
+	return get_compute_capability() >= (7, 5)
+
+def get_encoder_options(target_bitrate: int, nvenc_preset: str):
+	"""Builds the NVENC output options for a constant target bitrate"""
+	encoder_options = {
+		**ENCODER_OPTIONS,
+		'preset': nvenc_preset,
+		'b:v': target_bitrate*1000,
+		'maxrate': target_bitrate*1000,
+		'bufsize': target_bitrate*2000
+	}
+	if gpu_supports_b_frames():
+		encoder_options.update(B_FRAME_OPTIONS)
+	return encoder_options
+
+def get_video_stream(video_probe):
+	"""Returns the first video stream of a probe result"""
+	for stream in video_probe['streams']:
+		if stream['codec_type'] == 'video':
+			return stream
+	return None
+
+def parse_rational(value: str):
+	"""Parses ffprobe fractions like '30000/1001', returns 0 if it's undefined"""
+	numerator, _, denominator = value.partition('/')
+	denominator = float(denominator or 1)
+	return float(numerator) / denominator if denominator else 0.0
+
+def get_duration(video_probe):
+	"""Returns the duration in seconds, derived from the video stream if the container doesn't store it"""
+	duration = video_probe['format'].get('duration', 'N/A')
+	if duration != 'N/A':
+		return float(duration)
+
+	stream = get_video_stream(video_probe)
+	if stream is None:
+		return 0.0
+	if stream.get('duration', 'N/A') != 'N/A':
+		return float(stream['duration'])
+	frame_rate = parse_rational(stream.get('r_frame_rate', '0/0'))
+	if stream.get('nb_frames') and frame_rate:
+		return int(stream['nb_frames']) / frame_rate
+	return 0.0
+
+def needs_downscaling(video_probe, target_height: int):
+	"""Checks if the video is taller than the target height, 0 meaning no target"""
+	stream = get_video_stream(video_probe)
+	return target_height > 0 and stream is not None and stream['height'] > target_height
+
+def get_input_options(video_probe):
+	"""Decodes on the GPU when NVDEC supports the video, so frames never leave VRAM"""
+	stream = get_video_stream(video_probe)
+	if stream is None or stream['codec_name'] not in NVDEC_DECODERS:
+		return {}
+	decoder, pixel_formats, compute_capability = NVDEC_DECODERS[stream['codec_name']]
+	if stream.get('pix_fmt') not in pixel_formats or get_compute_capability() < compute_capability:
+		return {}
+	return {
+		'hwaccel': 'cuda',
+		'hwaccel_device': 'cu',
+		'hwaccel_output_format': 'cuda',
+		'c:v': decoder
+	}
 
-	# Loop trough all videos and compress them to target bitrate
-	video_count = len(videos)
+class progress_display:
+	"""Draws a single progress bar for all compression processes running in parallel"""
+	def __init__(self, video_count: int, group_durations: list[float]):
+		self.video_count = video_count
+		self.done_count = 0
+		self.group_durations = group_durations
+		self.group_progress = [0.0] * len(group_durations)
+		self.encoded_duration = 0.0
+		self.total_duration = sum(group_durations) or 1
+		self.filled = 0
+
+		# The bar is drawn often, so it's kept as raw bytes that are only changed in place
+		self.text_base = self.encode(f'\r{self.done_count}/{self.video_count} | ')
+		self.progress_bar = bytearray(b' ' * PROGRESS_BAR_LEN)
+		self.filled_bar = memoryview(b'#' * PROGRESS_BAR_LEN)
+		self.empty_bar = memoryview(b' ' * PROGRESS_BAR_LEN)
+
+	@staticmethod
+	def encode(text: str):
+		return text.encode(sys.stdout.encoding or 'utf-8', 'replace')
+
+	def get_filled(self):
+		return min(round(PROGRESS_BAR_LEN * self.encoded_duration / self.total_duration), PROGRESS_BAR_LEN)
+
+	def set_group_progress(self, group_index: int, encoded_duration: float):
+		self.encoded_duration += encoded_duration - self.group_progress[group_index]
+		self.group_progress[group_index] = encoded_duration
+
+	def draw(self):
+		self.filled = self.get_filled()
+		self.progress_bar[:self.filled] = self.filled_bar[:self.filled]
+		self.progress_bar[self.filled:] = self.empty_bar[self.filled:]
+		output = sys.stdout.buffer
+		output.write(self.text_base)
+		output.write(self.progress_bar)
+		output.write(b' |')
+		output.flush()
+
+	def update(self, group_index: int, progress: float):
+		"""Sets how far along a group is, from 0 to 1"""
+		self.set_group_progress(group_index, min(progress, 1) * self.group_durations[group_index])
+
+		# Most reports don't move the bar, those don't need to be drawn
+		if self.get_filled() != self.filled:
+			self.draw()
+
+	def finish(self, videos: list[dir_item], error: str = None):
+		"""Prints finished videos above the progress bar, with the error if they failed"""
+		status = '✓' if error is None else f'✗ {error}'
+		# Clear the whole progress line, its length is the (carriage return prefixed) text base, bar and ' |'
+		finished = ['\r' + ' ' * (len(self.text_base) - 1 + PROGRESS_BAR_LEN + 2)]
+		for video in videos:
+			self.done_count += 1
+			finished.append(f'\r{self.done_count}/{self.video_count} | {video.name} | {status}\n')
+		sys.stdout.buffer.write(self.encode(''.join(finished)))
+		self.text_base = self.encode(f'\r{self.done_count}/{self.video_count} | ')
+		self.draw()
+
+async def monitor_compression_progress(process: asyncio.subprocess.Process, on_progress):
+	"""Follows the progress reports ffmpeg streams to stdout, passing the encoded seconds to on_progress"""
+	last_time = 0
+	async for line in process.stdout:
+		if line.startswith(b'out_time_us='):
+			out_time = line.split(b'=')[1].strip()
+			if out_time.isdigit():
+				last_time = int(out_time) / 1000000
+		elif line.startswith(b'progress=end'):
+			return
+		elif line.startswith(b'progress='):
+			# Every report ends with a progress line, so update the progress bar once per report
+			on_progress(last_time)
+
+async def run_ffmpeg(command: list[str], on_progress):
+	"""Runs an ffmpeg command, returns None if it succeeded or the error message if it didn't"""
+
+	# Start the compression process, with progress reports piped to stdout and errors to stderr
+	try:
+		process = await asyncio.create_subprocess_exec(
+			*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+		)
+	except OSError as e:
+		return f'Could not start ffmpeg: {e}'
+	errors = asyncio.create_task(process.stderr.read())
+
+	# Follow the progress until ffmpeg closes its stdout
+	await monitor_compression_progress(process, on_progress)
+	await process.wait()
+	error_lines = (await errors).decode(errors='replace').strip().splitlines()
+
+	if process.returncode == 0:
+		return None
+	return error_lines[-1] if error_lines else f'ffmpeg exited with code {process.returncode}'
+
+class session_pool:
+	"""Hands out NVENC sessions in request order, so all running ffmpeg processes together stay within the limit"""
+	def __init__(self, size: int):
+		self.free = size
+		self.waiting = collections.deque()
+		self.condition = asyncio.Condition()
+
+	@contextlib.asynccontextmanager
+	async def sessions(self, count: int):
+		"""Waits until count sessions are free and holds them for the duration of the with block"""
+		token = object()
+		async with self.condition:
+			self.waiting.append(token)
+			await self.condition.wait_for(lambda: self.waiting[0] is token and self.free >= count)
+			self.waiting.popleft()
+			self.free -= count
+			self.condition.notify_all() # The next in line may fit in what's left
+		try:
+			yield
+		finally:
+			async with self.condition:
+				self.free += count
+				self.condition.notify_all()
+
+def group_videos(videos: list[dir_item]):
+	"""Gives every long video its own ffmpeg process and shares the processes between short ones"""
+	long_videos = sorted(
+		(video for video in videos if video.duration >= SHORT_VIDEO_DURATION),
+		key=lambda video: video.duration, reverse=True
+	)
+	short_videos = sorted(
+		(video for video in videos if video.duration < SHORT_VIDEO_DURATION),
+		key=lambda video: video.duration, reverse=True
+	)
+
+	# Process startup only matters next to the encode time of short videos. Every output of a process
+	# is encoded at the same time in its own NVENC session, so a process gets at most NVENC_SESSION_LIMIT,
+	# and similar durations are kept together so the sessions finish around the same time.
+	groups = [[video] for video in long_videos]
+	for i in range(0, len(short_videos), NVENC_SESSION_LIMIT):
+		groups.append(short_videos[i:i + NVENC_SESSION_LIMIT])
+	return groups, [sum(video.duration for video in group) for group in groups]
+
+def get_output_path(video: dir_item, output_path: str, partial: bool = False):
+	"""Returns where the compressed version of a video is stored, or where it's written to while compressing"""
+	name, extension = video.name.rsplit('.', 1)
+	return os.path.join(output_path, name + ('c.part.' if partial else 'c.') + extension)
+
+def store_outputs(videos: list[dir_item], output_path: str):
+	"""Moves the outputs of successfully compressed videos into place, replacing those of earlier runs"""
 	for video in videos:
-		video_probe = ffmpeg.probe(video.path)
-		total_frames = int(video_probe['streams'][0]['nb_frames'])
+		os.replace(get_output_path(video, output_path, partial=True), get_output_path(video, output_path))
 
-		# Rename and get the new full output path
-		name, extension = video.name.split('.')
-		output_name = name+ 'c.' + extension
-		full_output_path = os.path.join(output_path, output_name)
-
-		text_base = f'{videos.index(video)+1}/{video_count} | {video.name} |'
-
-		# Start thread for progress bar
-		thread = threading.Thread(target=monitor_compression_progress, args=(temp_file, text_base, total_frames))
-		thread.start()
-
-		# Start the compression process
-		video_input = ffmpeg.input(video.path)
-		ffmpeg.output(video_input, full_output_path,
-			**{'c:v': 'hevc_nvenc', 'b:v': target_bitrate*1000, 'loglevel': 'quiet', 'progress': temp_file}
-		).overwrite_output().run()
-
-		# Stop the thread
-		thread.join()
-
-		# Clears the temporary file for next compression
-		open(temp_file, 'w').close()
-
-	# Remove the temporary file
-	if os.path.exists(temp_file):
-		os.remove(temp_file)
+def remove_partial_outputs(videos: list[dir_item], output_path: str):
+	"""Removes the partly written outputs of failed videos, outputs of earlier runs are left alone"""
+	for video in videos:
+		try:
+			os.remove(get_output_path(video, output_path, partial=True))
+		except OSError:
+			pass
+
+def build_group_command(videos: list[dir_item], encoder_options: dict, output_path: str, target_height: int, gpu_decoding: bool = True):
+	"""Builds the ffmpeg command that compresses a group of videos as the outputs of a single process"""
+	outputs = []
+	for video in videos:
+		full_output_path = get_output_path(video, output_path, partial=True)
+
+		input_options = get_input_options(video.probe) if gpu_decoding else {}
+		video_input = ffmpeg.input(video.path, **input_options)
+
+		# Only add a filter when downscaling, otherwise frames go straight from decoder to encoder
+		video_stream = video_input['v:0']
+		if needs_downscaling(video.probe, target_height):
+			scaler = 'scale_cuda' if input_options else 'scale'
+			video_stream = video_stream.filter(scaler, w=-2, h=target_height)
+
+		# Map streams explicitly, otherwise ffmpeg picks them from all inputs
+		outputs.append(ffmpeg.output(video_stream, video_input['a?'], full_output_path,
+			**encoder_options
+		))
+
+	return ffmpeg.compile(ffmpeg.merge_outputs(*outputs).global_args(
+		'-nostdin', '-init_hw_device', 'cuda=cu:0', '-filter_hw_device', 'cu', '-loglevel', 'error', '-progress', 'pipe:1'
+	).overwrite_output())
+
+async def encode_videos(videos: list[dir_item], encoder_options: dict, output_path: str, target_height: int, pool: session_pool, on_progress, gpu_decoding: bool = True):
+	"""Encodes videos as the outputs of a single ffmpeg process, returns None or the error message"""
+	command = build_group_command(videos, encoder_options, output_path, target_height, gpu_decoding)
+	async with pool.sessions(len(videos)):
+		error = await run_ffmpeg(command, on_progress)
+
+	# Outputs are written under a temporary name, so a failure never touches what an earlier run stored
+	if error is None:
+		try:
+			store_outputs(videos, output_path)
+		except OSError as e:
+			error = f'Could not store the compressed video: {e}'
+	if error is not None:
+		remove_partial_outputs(videos, output_path)
+
+		# NVDEC can still turn a video down (profile, size, ffmpeg build), so a lone video gets another go on the CPU
+		if gpu_decoding and len(videos) == 1 and get_input_options(videos[0].probe):
+			return await encode_videos(videos, encoder_options, output_path, target_height, pool, on_progress, False)
+	return error
+
+async def compress_group(videos: list[dir_item], encoder_options: dict, output_path: str, target_height: int, display: progress_display, group_index: int, pool: session_pool):
+	"""Compresses a group of videos as the outputs of a single ffmpeg process, returns the videos that failed"""
+
+	# Outputs progress in lockstep, so the group is done when its longest video is
+	total_duration = max(video.duration for video in videos) or 1
+	error = await encode_videos(videos, encoder_options, output_path, target_height, pool,
+		lambda encoded: display.update(group_index, encoded / total_duration)
+	)
+	if error is None or len(videos) == 1:
+		display.update(group_index, 1)
+		display.finish(videos, error)
+		return [] if error is None else videos
+
+	# One broken video stops the whole process, so the videos are retried one by one to only skip that one
+	display.update(group_index, 0)
+	group_duration = sum(video.duration for video in videos) or 1
+	done_duration = 0.0
+	failed_videos = []
+	for video in videos:
+		error = await encode_videos([video], encoder_options, output_path, target_height, pool,
+			lambda encoded: display.update(group_index, (done_duration + min(encoded, video.duration)) / group_duration)
+		)
+		if error is not None:
+			failed_videos.append(video)
+		done_duration += video.duration
+		display.update(group_index, done_duration / group_duration)
+		display.finish([video], error)
+	return failed_videos
+
+async def compress_groups(groups: list[list[dir_item]], encoder_options: dict, output_path: str, target_height: int, display: progress_display):
+	"""Compresses all groups concurrently, using at most NVENC_SESSION_LIMIT NVENC sessions at a time"""
+	pool = session_pool(NVENC_SESSION_LIMIT)
+	return await asyncio.gather(*(
+		compress_group(group, encoder_options, output_path, target_height, display, i, pool)
+		for i, group in enumerate(groups)
+	))
+
+def compress_videos(videos: list[dir_item], target_bitrate: int, output_path: str, nvenc_preset: str = DEFAULT_NVENC_PRESET, target_height: int = 0):
+	"""Compresses all videos to the target bitrate, returns the videos that failed"""
+
+	# Lets the parallel NVENC sessions share the GPU with fewer CUDA connections each
+	os.environ.setdefault('CUDA_DEVICE_MAX_CONNECTIONS', CUDA_DEVICE_MAX_CONNECTIONS)
+
+	encoder_options = get_encoder_options(target_bitrate, nvenc_preset)
+
+	# Run one ffmpeg process per group, as many at the same time as there are NVENC sessions for
+	groups, group_durations = group_videos(videos)
+	display = progress_display(len(videos), group_durations)
+	display.draw()
+	failed_videos = asyncio.run(compress_groups(groups, encoder_options, output_path, target_height, display))
+	print()
+
+	return [video for group_failed_videos in failed_videos for video in group_failed_videos]
 
 class navigator():
 	"""The main object that handles path navigation"""
-	commands = ['cd', 'add', 'addall', 'remove', 'removeall', 'view', 'bitrate', 'output', 'run', 'quit', 'exit', 'help']
+	commands = ['cd', 'add', 'addall', 'remove', 'removeall', 'view', 'bitrate', 'resolution', 'output', 'run', 'quit', 'exit', 'help']
 	current_dir = os.getcwd()
 	directory_items: list[dir_item] = []
-	selected_videos: list[dir_item] = []
+	_selected_by_path: dict[str, dir_item] = {} # In order of selection
+	_last_scan: dict[str, dict[str, tuple[tuple[int, int], dir_item]]] = {} # Per directory: scanned videos by path, with the (mtime, size) they were scanned at
 	target_bitrate: int = 0
+	nvenc_preset = DEFAULT_NVENC_PRESET
+	target_height: int = 0
 	output_path = ''
 
 	def __init__(self):
 		self.get_directory_contents()
 
+	@property
+	def selected_videos(self):
+		return list(self._selected_by_path.values())
+
 	def get_directory_contents(self):
 		"""Gathers all relevant info on the directory's files and stores it"""
 		relevant_content = filter_relevant_content(self.current_dir)
 
+		# Only the videos still in the directory are kept for the next scan
+		last_scan = self._last_scan.get(self.current_dir, {})
+		scan = {}
+
 		self.directory_items = []
-		for i in range(len(relevant_content)):
+		for i, (name, is_file) in enumerate(relevant_content):
+			path = os.path.join(self.current_dir, name)
+
+			# Videos that haven't changed since they were last scanned can be reused as they are
+			if is_file:
+				file_stamp = get_file_stamp(path)
+				scanned = last_scan.get(path)
+				if scanned is not None and scanned[0] == file_stamp:
+					item = scanned[1]
+					item.ID = i
+					scan[path] = scanned
+					self.directory_items.append(item)
+					continue
+
 			item = dir_item()
 			item.ID = i
-			item.name = relevant_content[i]
-			item.path = os.path.join(self.current_dir, item.name)
-			item.is_file = os.path.isfile(item.path)
+			item.name = name
+			item.path = path
+			item.is_file = is_file
 
 			if item.is_file:
-				video_format = ffmpeg.probe(item.path)['format']
+				item.probe = ffmpeg.probe(item.path)
+				video_format = item.probe['format']
 
-				item.extension = item.name.split('.')[-1]
+				item.extension = item.name.rpartition('.')[2]
 				item.size = int(video_format['size'])
-				item.duration = float(video_format['duration'])
-				item.bitrate = int(video_format['bit_rate']) // 1000
+				item.duration = get_duration(item.probe)
+				if video_format.get('bit_rate', 'N/A') != 'N/A':
+					item.bitrate = int(video_format['bit_rate']) // 1000
+				else:
+					item.bitrate = round(item.size * 8 / item.duration) // 1000 if item.duration else 0
+				scan[item.path] = (file_stamp, item)
 			else:
 				item.extension = 'Folder'
 			
 			self.directory_items.append(item)
+		self._last_scan[self.current_dir] = scan
 
 		# Fix selected items
-		for selected_item in self.selected_videos:
-			for i in range(len(self.directory_items)):
-				if selected_item.path == self.directory_items[i].path:
-					self.directory_items.pop(i)
-					self.directory_items.append(selected_item)
+		if self._selected_by_path:
+			for i, item in enumerate(self.directory_items):
+				selected_item = self._selected_by_path.get(item.path)
+				if selected_item is not None:
+					selected_item.ID = item.ID
+					self.directory_items[i] = selected_item
 
 		return OK
 	
@@ -180,34 +517,30 @@ class navigator():
 		"""Shows directory content in a neat way"""
 
 		# Create view
-		view = f'ID | {'Filename':^{MAX_FILENAME_LEN}} | Extension |   Size   | Duration |    Bitrate    | Selected |'
+		view = [f'ID | {"Filename":^{MAX_FILENAME_LEN}} | Extension |   Size   | Duration |    Bitrate    | Selected |']
 
 		for item in self.directory_items:
-			item_view = f'\n{item.ID:<3}| '
-			item.name
-			name = str(item.name)
+			name = item.name
 			if len(name) > MAX_FILENAME_LEN:
 				name = name[:MAX_FILENAME_LEN-3] + '...'
 
 			if item.is_file:
-				size = item.size // 1000000
-				if size > 1000:
-					size = f'{size/1000:.4} GB'
+				size_mb = item.size // 1000000
+				if size_mb > 1000:
+					size = f'{size_mb/1000:.4} GB'
 				else:
-					size = f'{size} MB'
+					size = f'{size_mb} MB'
 
 				duration = f'{int(item.duration // 60)}:{round(item.duration % 60):0>2}'
 				bitrate = f'{item.bitrate:,} kbps'
 				selected = '✓' if item.is_selected else ''
 
-				item_view += f'{name:<{MAX_FILENAME_LEN}} | {item.extension:<10}| {size:<9}| {duration:<9}| {bitrate:<14}| {selected:^9}|'
+				view.append(f'{item.ID:<3}| {name:<{MAX_FILENAME_LEN}} | {item.extension:<10}| {size:<9}| {duration:<9}| {bitrate:<14}| {selected:^9}|')
 			else:
 				output = ' <- Output dir' if item.path == self.output_path else ''
-				item_view += f'{name:<{MAX_FILENAME_LEN}} | {item.extension:<10}{output}'
-			
-			view += item_view
+				view.append(f'{item.ID:<3}| {name:<{MAX_FILENAME_LEN}} | {item.extension:<10}{output}')
 
-		print(f'{view}\n')
+		sys.stdout.write('\n'.join(view) + '\n\n')
 
 	def navigation_menu(self):
 		"""Shows the navigation menu and handles commands"""
@@ -260,43 +593,35 @@ class navigator():
 		number_ID = int(ID[0])
 		for item in self.directory_items:
 			if number_ID == item.ID and item.is_file:
-				if item in self.selected_videos:
+				if item.path in self._selected_by_path:
 					return ERR_ALREADY_SELECTED
 				else:
 					item.is_selected = True
-					self.selected_videos.append(item)
+					self._selected_by_path[item.path] = item
 					return OK
 	
 	def addall(self, _):
 		"""Adds all videos in current folder to selection."""
 		for item in self.directory_items:
-			if item.is_file:
-				if not item in self.selected_videos:
-					item.is_selected = True
-					self.selected_videos.append(item)
+			if item.is_file and item.path not in self._selected_by_path:
+				item.is_selected = True
+				self._selected_by_path[item.path] = item
 		return OK
 
 	def remove(self, ID):
 		"""Removes video from selection by ID."""
 		number_ID = int(ID[0])
-		item_found = False
-		for item in self.selected_videos:
-			if number_ID == item.ID:
-				if item in self.selected_videos:
-					item.is_selected = False
-					item_found = True
-					self.selected_videos.remove(item)
-
-		if item_found:
-			return OK
-		else:
-			return ERR_NOT_IN_SELECTION
+		for item in self.directory_items:
+			if number_ID == item.ID and item.path in self._selected_by_path:
+				self._selected_by_path.pop(item.path).is_selected = False
+				return OK
+		return ERR_NOT_IN_SELECTION
 
 	def removeall(self, _):
 		"""removes all videos from selection."""
-		for item in self.selected_videos:
+		for item in self._selected_by_path.values():
 			item.is_selected = False
-		self.selected_videos = []
+		self._selected_by_path.clear()
 		return OK
 		
 	def view(self, _):
@@ -311,8 +636,23 @@ class navigator():
 		"""Sets the target bitrate after compression in kbps or literal['low', 'medium', 'high']"""
 		if target_bitrate[0].isdigit():
 			self.target_bitrate = int(target_bitrate[0])
+			self.nvenc_preset = DEFAULT_NVENC_PRESET
+			return OK
+		elif target_bitrate[0] in BITRATE_PRESETS:
+			self.target_bitrate, self.nvenc_preset = BITRATE_PRESETS[target_bitrate[0]]
+			return OK
+		else:
+			return ERR_INVALID_ARG
+
+	def resolution(self, target_height):
+		"""Sets the maximum video height after compression in pixels or 'source' to keep it as is"""
+		if not target_height:
+			return ERR_INVALID_ARG
+		elif target_height[0].isdigit() and int(target_height[0]) > 0:
+			self.target_height = int(target_height[0])
 			return OK
-		elif target_bitrate[0] in ['low', 'medium', 'high']:
+		elif target_height[0] == 'source':
+			self.target_height = 0
 			return OK
 		else:
 			return ERR_INVALID_ARG
@@ -357,7 +697,7 @@ class navigator():
 		"""Starts compressing all videos in selection."""
 
 		# Check if all required values are set.
-		if self.selected_videos == []:
+		if not self._selected_by_path:
 			return ERR_NO_VIDEOS_SELECTED
 		elif self.target_bitrate == 0:
 			return ERR_NO_TARGET_BITRATE
@@ -374,7 +714,8 @@ class navigator():
 				for item in self.selected_videos:
 					print(f'{item.name}')
 				print('------------------------------------------')
-				print(f'Target bitrate: {self.target_bitrate} kbps')
+				print(f'Target bitrate: {self.target_bitrate} kbps (NVENC preset {self.nvenc_preset})')
+				print(f'Resolution: {f"{self.target_height}p" if self.target_height else "source"}')
 				print(f'Output path: {self.output_path}')
 				answer = input('Confirm? (y/n) ').lower()
 				if answer in ['y', 'n']:
@@ -382,12 +723,17 @@ class navigator():
 
 			# Handle confirmation answer.
 			if answer == 'y':
-				compress_videos(self.selected_videos, self.target_bitrate, self.output_path)
-				video_count = len(self.selected_videos)
-				if video_count == 1:
+				failed_videos = compress_videos(self.selected_videos, self.target_bitrate, self.output_path, self.nvenc_preset, self.target_height)
+				video_count = len(self.selected_videos) - len(failed_videos)
+				if failed_videos:
+					print(f'Done, but {len(failed_videos)} video(s) could not be compressed:')
+					for item in failed_videos:
+						print(f'{item.name}')
+					print(f'The other {video_count} compressed video(s) are stored in {self.output_path}')
+				elif video_count == 1:
 					print(f'Done!\n1 compressed video is stored in \'{self.output_path}\'')
 				else:
-					print(f'Done!\nAll {len(self.selected_videos)} compressed videos are stored in {self.output_path}')
+					print(f'Done!\nAll {video_count} compressed videos are stored in {self.output_path}')
 				input(CONTINUE_MESSAGE)
 				return OK
 			elif answer == 'n':
@@ -406,6 +752,8 @@ class navigator():
 		return OK
 
 	def __setattr__(self, name, value):
+		if name == 'current_dir' and getattr(self, name, None) == value:
+			return
 		super().__setattr__(name, value)
 		if name == 'current_dir': # To make sure the directory contents are re-accuired when path is changed
 			self.get_directory_contents()